@@ -1,34 +1,90 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
 from flask import Flask, request, jsonify
 
-from transformers import AutoModel
+from transformers import AutoModel, AutoTokenizer
 
+MODEL_NAME = "jinaai/jina-embeddings-v3"
+MAX_BATCH_SIZE = 64
+MAX_WAIT_SECONDS = 0.01
 
 
 app = Flask(__name__)
+model = AutoModel.from_pretrained(MODEL_NAME, trust_remote_code=True)
+tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, trust_remote_code=True)
 print("Model initialized")
-model = AutoModel.from_pretrained("jinaai/jina-embeddings-v3", trust_remote_code=True)
+
+pending = queue.Queue()
+
+
+def batch_worker():
+    """Encodes queued texts together, waiting at most MAX_WAIT_SECONDS after the first request."""
+    while True:
+        batch = [pending.get()]
+        deadline = time.monotonic() + MAX_WAIT_SECONDS
+        size = len(batch[0][0])
+        while size < MAX_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        texts = [text for prompts, _ in batch for text in prompts]
+        try:
+            outputs = model.encode(texts, task="text-matching").tolist()
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            continue
+        start = 0
+        for prompts, future in batch:
+            future.set_result(outputs[start : start + len(prompts)])
+            start += len(prompts)
+
+
+threading.Thread(target=batch_worker, daemon=True).start()
 
 
 @app.route('/v1/embeddings', methods=['POST'])
 def embeddings():
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     prompts = data.get('input', [])
-    if isinstance(prompts, list) and len(prompts) > 0:
-        prompts = prompts[0]
-    outputs = model.encode(prompts,task="text-matching")
+    if isinstance(prompts, str):
+        prompts = [prompts]
+    if not isinstance(prompts, list) or not all(isinstance(prompt, str) for prompt in prompts):
+        # Checked here, a bad input would fail every request batched with it.
+        error = {"message": "'input' must be a string or a list of strings", "type": "invalid_request_error"}
+        return jsonify({"error": error}), 400
+    if not prompts:
+        return jsonify({"data": [], "model": MODEL_NAME, "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+    future = Future()
+    pending.put((prompts, future))
+    outputs = future.result()
+    tokens = sum(len(ids) for ids in tokenizer(prompts)["input_ids"])
     resp = jsonify( {
+        "object": "list",
         "data": [
             {
-            "embedding": outputs.tolist(),
+            "object": "embedding",
+            "index": index,
+            "embedding": embedding,
             }
+            for index, embedding in enumerate(outputs)
             ],
-  "model": "my-model",
+  "model": MODEL_NAME,
   "usage": {
-    "prompt_tokens": 8,
-    "total_tokens": 8
+    "prompt_tokens": tokens,
+    "total_tokens": tokens
   }
 })
     return resp
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, threaded=True)
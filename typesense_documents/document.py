@@ -1,13 +1,94 @@
+import gzip
+import bisect
+import hashlib
+import heapq
+import json
+import os
+import re
+import zlib
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import typesense
 from django.conf import settings
+from django.db.models import QuerySet
 from typesense_documents.fields import BaseField, EmbeddingField, ImageField, SentenceTransformerEmbeddingField
+from typesense_documents.results import decode_hits, decode_multi_search_hits, format_hits, merge_hits, parse_sort_by
 from tqdm import tqdm
- 
+
+
+MAX_PER_PAGE = 250
+
+
+def sort_ids(ids, run_size=65536):
+    """
+    Returns a sorted copy of an ``array("q")``.
+
+    Runs of ``run_size`` ids are sorted separately and merged, so only one run
+    exists as Python ints at a time.
+    """
+    runs = []
+    for start in range(0, len(ids), run_size):
+        runs.append(array("q", sorted(ids[start : start + run_size])))
+    return array("q", heapq.merge(*runs))
+
+
+def sort_id_pairs(ids, values, run_size=65536):
+    """
+    Returns copies of two aligned ``array("q")`` sorted by ``ids``, sorting and
+    merging runs like ``sort_ids``.
+    """
+    runs = []
+    for start in range(0, len(ids), run_size):
+        run = sorted(zip(ids[start : start + run_size], values[start : start + run_size]))
+        runs.append((array("q", (id_value for id_value, _ in run)), array("q", (value for _, value in run))))
+        del run
+    sorted_ids = array("q")
+    sorted_values = array("q")
+    for id_value, value in heapq.merge(*(zip(run_ids, run_values) for run_ids, run_values in runs)):
+        sorted_ids.append(id_value)
+        sorted_values.append(value)
+    return sorted_ids, sorted_values
+
+
+def get_hash_key(content_hash):
+    """Returns the first 64 bits of a hex content hash as a signed integer, 0 when there is none."""
+    if not content_hash:
+        return 0
+    return int.from_bytes(bytes.fromhex(content_hash[:16]), "big", signed=True)
+
+
+def iterate_lines(text):
+    """Yields non-empty lines of ``text`` one by one, without splitting it into a list."""
+    start = 0
+    length = len(text)
+    while start < length:
+        end = text.find("\n", start)
+        if end == -1:
+            end = length
+        if end > start:
+            yield text[start:end]
+        start = end + 1
+
+
+def sorted_difference(left, right):
+    """Yields values of sorted ``left`` that are missing from sorted ``right``."""
+    right_index = 0
+    right_length = len(right)
+    for value in left:
+        while right_index < right_length and right[right_index] < value:
+            right_index += 1
+        if right_index == right_length or right[right_index] != value:
+            yield value
 
 
 class TypesenseDocument:
     collection_name = None
     default_sorting_fields = None
+    batch_size = 100
+    content_hash_field = None
+    shard_count = None
+    shard_field = None
 
     fields = []
     sentence_transformer_model = None
@@ -48,30 +129,94 @@ class TypesenseDocument:
             field_schema = field_type.get_field_schema()
             field_schema["name"] = name
             fields_schema_list.append(field_schema)
+        if self.content_hash_field:
+            fields_schema_list.append({"name": self.content_hash_field, "type": "string", "index": False, "optional": True})
         schema["fields"] = fields_schema_list
         return schema
 
     def create_collection(self):
-        try:
-            collections = self.typesense_client.collections.retrieve()
-            exists = False
-            for collection in collections:
-                if collection["name"] == self.collection_name:
-                    exists = True
-                    break
-            if exists:
-                self.typesense_client.collections[self.collection_name].delete()
+        for collection_name in self.get_collection_names():
+            try:
+                collections = self.typesense_client.collections.retrieve()
+                exists = False
+                for collection in collections:
+                    if collection["name"] == collection_name:
+                        exists = True
+                        break
+                if exists:
+                    self.typesense_client.collections[collection_name].delete()
+
+                self.typesense_client.collections.create(dict(self.collection_schema, name=collection_name))
+            except:
+                pass
+
+    def get_collection_names(self):
+        """Returns names of all collections of the document, one per shard when sharded."""
+        if not self.shard_count:
+            return [self.collection_name]
+        return [self.get_shard_collection_name(shard) for shard in range(self.shard_count)]
+
+    def get_shard_collection_name(self, shard):
+        return f"{self.collection_name}_{shard}"
 
-            self.typesense_client.collections.create(self.collection_schema)
-        except:
-            pass
+    def get_shard_key(self, instance):
+        return getattr(instance, self.shard_field or self.Meta.id_field or "pk")
 
-    def prepare_collection_document(self, obj):
+    def get_shard(self, shard_key):
+        """
+        Returns the shard number (``0 <= shard < shard_count``) for a shard key value.
+
+        Override to shard by something else than a hash, e.g. a time bucket.
+        """
+        return zlib.crc32(str(shard_key).encode("utf-8")) % self.shard_count
+
+    def get_instance_collection_name(self, instance):
+        if not self.shard_count:
+            return self.collection_name
+        return self.get_shard_collection_name(self.get_shard(self.get_shard_key(instance)))
+
+    def get_search_collection_names(self, filter_by=None, shard_key=None):
+        """
+        Returns collections a search has to go to: the shard pinned by ``shard_key``
+        or by an exact ``shard_field:=value`` condition of ``filter_by``, all shards
+        otherwise. ``shard_field:value`` (a token or prefix match on strings),
+        wildcards, negations, ranges and lists don't pin a shard.
+        """
+        if not self.shard_count:
+            return [self.collection_name]
+        if shard_key is None and filter_by and self.shard_field and "||" not in filter_by:
+            match = re.search(
+                rf"(?:^|&&)\s*{re.escape(self.shard_field)}\s*:=\s*"
+                rf"(?:`([^`*]*)`|([^\s`&|()\[\]!<>=*][^&|()\[\]*]*?))\s*(?:&&|$)",
+                filter_by,
+            )
+            if match:
+                shard_key = match.group(1) if match.group(1) is not None else match.group(2)
+        if shard_key is not None:
+            return [self.get_shard_collection_name(self.get_shard(shard_key))]
+        return self.get_collection_names()
+
+    def is_shard_key_changed(self, changed_fields, affected_fields):
+        """
+        Tells whether a save may have moved the instance to another shard. A shard
+        key that isn't a model column can't be tracked and is assumed to change
+        whenever an indexed field does.
+        """
+        if not self.shard_count or not self.shard_field or not changed_fields:
+            return False
+        for model_field in self.Meta.model._meta.concrete_fields:
+            if self.shard_field in (model_field.name, model_field.attname):
+                return model_field.attname in changed_fields
+        return bool(affected_fields)
+
+    def prepare_collection_document(self, obj, only=None):
         fields = self.fields
         document = {}
         embeddings = []
         sentence_transformers_fields = []
         for name, field_type in fields.items():
+            if only is not None and name not in only:
+                continue
             if isinstance(field_type, EmbeddingField):
                 embeddings.append(field_type)
                 continue
@@ -80,13 +225,7 @@ class TypesenseDocument:
                 sentence_transformers_fields.append(field_type)
                 continue
             else:
-                value = field_type.value
-                if value is None:
-                    value = name
-                attr = getattr(obj, value)
-                if callable(attr):
-                    attr = attr()
-                document[name] = field_type.prepare_value(attr)
+                document[name] = field_type.prepare_value(self.get_field_attr(obj, name, field_type))
         for embedding in embeddings:
             embed_field = embedding.from_field
             embed_value = document.get(embed_field)
@@ -100,6 +239,8 @@ class TypesenseDocument:
             else:
                 embeddings_for_document = sentence_transformer_field.prepare_value(embed_value, self.sentence_transformer_model)
                 document[sentence_transformer_field.field_name] = embeddings_for_document
+        if self.content_hash_field and only is None:
+            document[self.content_hash_field] = self.get_content_hash(obj, document)
         id_field = self.Meta.id_field or "pk"
         id_attr = getattr(obj, id_field)
 
@@ -108,9 +249,76 @@ class TypesenseDocument:
             return document
         raise TypeError
 
+    def get_content_fields(self):
+        """Returns names of the fields that are taken from the model as is (no embeddings)."""
+        return [
+            name
+            for name, field_type in self.fields.items()
+            if not isinstance(field_type, (EmbeddingField, SentenceTransformerEmbeddingField))
+        ]
+
+    def get_field_attr(self, obj, name, field_type):
+        attr = getattr(obj, field_type.value or name)
+        if callable(attr):
+            attr = attr()
+        return attr
+
+    def get_content_hash(self, obj, document=None):
+        """
+        Returns a hash of the indexed values of ``obj``, reusing values already
+        prepared in ``document``. Images are hashed by file name, so they are never
+        opened and encoded just for the hash.
+        """
+        content = {}
+        for name in self.get_content_fields():
+            field_type = self.fields[name]
+            if isinstance(field_type, ImageField):
+                content[name] = getattr(self.get_field_attr(obj, name, field_type), "name", None)
+            elif document is not None and name in document:
+                content[name] = document[name]
+            else:
+                content[name] = field_type.prepare_value(self.get_field_attr(obj, name, field_type))
+        return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
     def get_queryset(self):
         meta_model = self.Meta.model
-        return meta_model.objects.all()
+        return self.apply_prefetches(meta_model.objects.all())
+
+    def apply_prefetches(self, queryset):
+        select_related = getattr(self.Meta, "select_related", None)
+        prefetch_related = getattr(self.Meta, "prefetch_related", None)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    def iterate_chunks(self, instances):
+        """
+        Yields lists of at most ``batch_size`` instances.
+
+        Querysets are paginated by primary key, so only one chunk is held in
+        memory and their prefetches are done per chunk.
+        """
+        if isinstance(instances, QuerySet) and not instances.query.is_sliced:
+            queryset = instances.order_by("pk")
+            last_pk = None
+            while True:
+                chunk_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+                chunk = list(chunk_queryset[: self.batch_size])
+                if not chunk:
+                    break
+                yield chunk
+                last_pk = chunk[-1].pk
+        else:
+            chunk = []
+            for instance in instances:
+                chunk.append(instance)
+                if len(chunk) == self.batch_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
 
     def prepare_first_object(self):
         queryset = self.get_queryset()
@@ -126,7 +334,7 @@ class TypesenseDocument:
             try:
                 document = self.prepare_collection_document(obj)
                 if document is not None:
-                    self.typesense_client.collections[self.collection_name].documents.create(document)
+                    self.typesense_client.collections[self.get_instance_collection_name(obj)].documents.create(document)
                     counter += 1
             except Exception:
                 continue
@@ -141,16 +349,14 @@ class TypesenseDocument:
                 try:
                     objects.append(obj)
                     counter += 1
-                    if counter % 100 == 0:
-                        documents = self.prepare_batch_documents(objects)
-                        result = self.typesense_client.collections[self.collection_name].documents.import_(documents, {'action': 'create'})
+                    if counter % self.batch_size == 0:
+                        self.import_documents(objects, "create")
                         objects = []
                 except Exception as e:
                     print(e)
                     continue
         if objects:
-             documents = self.prepare_batch_documents(objects)
-             self.typesense_client.collections[self.collection_name].documents.import_(documents, {'action': 'create'})
+             self.import_documents(objects, "create")
         print(f"Total documents: {counter}...")
 
     def init_collection(self, use_batch=False):
@@ -161,22 +367,476 @@ class TypesenseDocument:
             self.fill_collection()
         print(f"Collection {self.collection_name} created")
 
-    def update_document(self, instance):
+    def get_affected_fields(self, changed_fields):
+        """
+        Returns names of the document fields whose source values are among
+        ``changed_fields`` (model attnames).
+
+        Fields filled from properties, methods or related objects can't be
+        tracked and are always treated as affected. Embedding fields follow
+        the field they are built from.
+        """
+        model_fields = {}
+        for model_field in self.Meta.model._meta.concrete_fields:
+            model_fields[model_field.name] = model_field.attname
+            model_fields[model_field.attname] = model_field.attname
+        affected = set()
+        for name, field_type in self.fields.items():
+            if isinstance(field_type, (EmbeddingField, SentenceTransformerEmbeddingField)):
+                continue
+            source = field_type.value or name
+            attname = model_fields.get(source)
+            if attname is None or attname in changed_fields:
+                affected.add(name)
+        for name, field_type in self.fields.items():
+            if isinstance(field_type, (EmbeddingField, SentenceTransformerEmbeddingField)):
+                if field_type.from_field in affected:
+                    affected.add(name)
+        return affected
+
+    def update_document(self, instance, changed_fields=None, created=False):
         index_document_id = getattr(instance, self.Meta.id_field or "pk")
         if index_document_id:
             index_document_id = str(index_document_id)
-            index_document_update = self.prepare_collection_document(instance)
+            collection_name = self.get_instance_collection_name(instance)
+            if changed_fields is not None:
+                affected_fields = self.get_affected_fields(changed_fields)
+                shard_key_changed = self.is_shard_key_changed(changed_fields, affected_fields)
+                if not affected_fields and not shard_key_changed:
+                    return
+                if shard_key_changed:
+                    self.delete_document(index_document_id)
+                    changed_fields = None
+            elif not created:
+                # Nothing is known about the previous shard key value.
+                self.delete_from_other_shards({collection_name: [index_document_id]})
+            if changed_fields is not None:
+                index_document_update = self.prepare_collection_document(instance, only=affected_fields)
+                if self.content_hash_field:
+                    index_document_update[self.content_hash_field] = self.get_content_hash(instance, index_document_update)
+            else:
+                index_document_update = self.prepare_collection_document(instance)
             try:
-                self.typesense_client.collections[self.collection_name].documents[index_document_id].update(index_document_update)
+                self.typesense_client.collections[collection_name].documents[index_document_id].update(index_document_update)
             except typesense.exceptions.ObjectNotFound:
-                self.typesense_client.collections[self.collection_name].documents.create(index_document_update)
+                if changed_fields is not None:
+                    index_document_update = self.prepare_collection_document(instance)
+                self.typesense_client.collections[collection_name].documents.create(index_document_update)
+
+    def prepare_collection_documents(self, instances):
+        """Yields ``(collection_name, documents)`` for ``instances`` grouped by collection."""
+        instances_by_collection = {}
+        for instance in instances:
+            instances_by_collection.setdefault(self.get_instance_collection_name(instance), []).append(instance)
+        for collection_name, collection_instances in instances_by_collection.items():
+            yield collection_name, self.prepare_batch_documents(collection_instances)
+
+    def import_documents(self, instances, action="upsert"):
+        """
+        Imports ``instances`` with one import per collection they belong to.
+        Failed documents are printed, the number of imported ones is returned.
+        Upserted documents are removed from the other shards, where they may
+        have been before their shard key changed.
+        """
+        counter = 0
+        ids_by_collection = {}
+        for collection_name, documents in self.prepare_collection_documents(instances):
+            results = self.typesense_client.collections[collection_name].documents.import_(documents, {"action": action})
+            for result in results:
+                if result.get("success"):
+                    counter += 1
+                else:
+                    print(result)
+            ids_by_collection[collection_name] = [document["id"] for document in documents]
+        if action == "upsert":
+            self.delete_from_other_shards(ids_by_collection)
+        return counter
+
+    def delete_from_other_shards(self, ids_by_collection):
+        """
+        Deletes ids from every shard except the one given for them in
+        ``ids_by_collection``. Only documents sharded by ``shard_field`` can move.
+        """
+        if not self.shard_count or not self.shard_field:
+            return
+        for collection_name in self.get_collection_names():
+            other_ids = [
+                id_value
+                for ids_collection_name, ids in ids_by_collection.items()
+                if ids_collection_name != collection_name
+                for id_value in ids
+            ]
+            for start in range(0, len(other_ids), self.batch_size):
+                chunk_ids = ",".join(f"`{id_value}`" for id_value in other_ids[start : start + self.batch_size])
+                self.typesense_client.collections[collection_name].documents.delete({"filter_by": f"id:[{chunk_ids}]"})
+
+    def dump_collection(self, directory, documents_per_file=10000):
+        """
+        Writes prepared documents (embeddings included) to gzipped JSONL files,
+        ``<directory>/<collection_name>/<number>.jsonl.gz``, for ``load_collection``.
+        Collection directories must be empty, so no files of an older dump are mixed in.
+        A chunk that fails to prepare aborts the dump; the manifest that
+        ``load_collection`` requires is only written once every row is dumped.
+
+        Fields embedded by Typesense itself (``EmbeddingField``) are calculated
+        again when the files are loaded.
+        """
+        if os.path.exists(self.get_manifest_path(directory)):
+            raise FileExistsError(f"{self.get_manifest_path(directory)} already exists")
+        for collection_name in self.get_collection_names():
+            collection_directory = os.path.join(directory, collection_name)
+            if os.path.isdir(collection_directory) and os.listdir(collection_directory):
+                raise FileExistsError(f"{collection_directory} is not empty")
+        print(f"Dumping {self.Meta.model.__name__}.")
+        files = {}
+        counter = 0
+        try:
+            for chunk in tqdm(self.iterate_chunks(self.get_queryset())):
+                for collection_name, documents in self.prepare_collection_documents(chunk):
+                    for document in documents:
+                        file_info = files.get(collection_name)
+                        if file_info is None or file_info[1] == documents_per_file:
+                            if file_info is not None:
+                                file_info[0].close()
+                            file_number = file_info[2] + 1 if file_info is not None else 0
+                            collection_directory = os.path.join(directory, collection_name)
+                            os.makedirs(collection_directory, exist_ok=True)
+                            file = gzip.open(os.path.join(collection_directory, f"{file_number:05d}.jsonl.gz"), "wt", encoding="utf-8")
+                            file_info = files[collection_name] = [file, 0, file_number]
+                        file_info[0].write(json.dumps(document))
+                        file_info[0].write("\n")
+                        file_info[1] += 1
+                        counter += 1
+        finally:
+            for file_info in files.values():
+                file_info[0].close()
+        os.makedirs(directory, exist_ok=True)
+        manifest = {
+            "collection_name": self.collection_name,
+            "shard_count": self.shard_count,
+            "collection_names": self.get_collection_names(),
+            "documents": counter,
+        }
+        with open(self.get_manifest_path(directory), "w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+        print(f"Total documents: {counter}...")
+
+    def get_manifest_path(self, directory):
+        return os.path.join(directory, f"{self.collection_name}.manifest.json")
+
+    def read_manifest(self, directory):
+        """Returns the manifest of a dump, checking it was made with the same collections."""
+        manifest_path = self.get_manifest_path(directory)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"{manifest_path} doesn't exist, the dump is missing or incomplete")
+        with open(manifest_path, encoding="utf-8") as file:
+            manifest = json.load(file)
+        if manifest["shard_count"] != self.shard_count or manifest["collection_names"] != self.get_collection_names():
+            raise ValueError(
+                f"{manifest_path} was written for collections {manifest['collection_names']}, "
+                f"not {self.get_collection_names()}"
+            )
+        return manifest
+
+    def read_dump_chunks(self, collection_directory):
+        """Yields JSONL strings of at most ``batch_size`` documents from a dumped collection."""
+        for file_name in sorted(os.listdir(collection_directory)):
+            if not file_name.endswith(".jsonl.gz"):
+                continue
+            with gzip.open(os.path.join(collection_directory, file_name), "rt", encoding="utf-8") as file:
+                lines = []
+                for line in file:
+                    if line.strip():
+                        lines.append(line.rstrip("\n"))
+                    if len(lines) == self.batch_size:
+                        yield "\n".join(lines)
+                        lines = []
+                if lines:
+                    yield "\n".join(lines)
+
+    def load_collection(self, directory, workers=4):
+        """
+        Creates the collections and imports documents written by ``dump_collection``.
+
+        Chunks are uploaded by ``workers`` threads and at most ``workers * 2``
+        chunks are held in memory at once. Raises ``TypesenseClientError`` when
+        fewer documents are imported than the manifest lists.
+        """
+        manifest = self.read_manifest(directory)
+        self.create_collection()
+        print(f"Loading {self.Meta.model.__name__}.")
+        counter = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for collection_name in self.get_collection_names():
+                collection_directory = os.path.join(directory, collection_name)
+                if not os.path.isdir(collection_directory):
+                    continue
+                documents = self.typesense_client.collections[collection_name].documents
+                for chunk in tqdm(self.read_dump_chunks(collection_directory)):
+                    if len(pending) >= workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        counter += sum(future.result() for future in done)
+                    pending.add(executor.submit(self.import_dump_chunk, documents, chunk))
+            for future in pending:
+                counter += future.result()
+        print(f"Total documents: {counter}...")
+        if counter != manifest["documents"]:
+            raise typesense.exceptions.TypesenseClientError(
+                f"{manifest['documents'] - counter} documents of {self.collection_name} failed to load"
+            )
+        print(f"Collection {self.collection_name} loaded")
+
+    def import_dump_chunk(self, documents, chunk):
+        result = documents.import_(chunk, {"action": "create"})
+        counter = 0
+        for line in result.splitlines():
+            if json.loads(line).get("success"):
+                counter += 1
+            else:
+                print(line)
+        return counter
+
+    def update_documents(self, instances):
+        """
+        Upserts ``instances`` (a queryset or an iterable) with one import per chunk.
+        Raises ``TypesenseClientError`` after all chunks if some documents failed.
+        """
+        counter = 0
+        failed = 0
+        for chunk in self.iterate_chunks(instances):
+            imported = self.import_documents(chunk)
+            counter += imported
+            failed += len(chunk) - imported
+        if failed:
+            raise typesense.exceptions.TypesenseClientError(f"{failed} documents of {self.collection_name} failed to import")
+        return counter
+
+    def update_related_documents(self, related_instance):
+        instances = self.get_instances_from_related(related_instance)
+        if isinstance(instances, QuerySet):
+            instances = self.apply_prefetches(instances)
+        return self.update_documents(instances)
+
+    def export_index_documents(self, include_fields="id"):
+        for collection_name in self.get_collection_names():
+            documents = self.typesense_client.collections[collection_name].documents.export({"include_fields": include_fields})
+            for line in iterate_lines(documents):
+                yield json.loads(line)
+            del documents
+
+    def get_database_ids(self):
+        """
+        Returns sorted ids of the queryset: an ``array("q")`` for integer ids,
+        a sorted list of strings otherwise.
+        """
+        id_field = self.Meta.id_field or "pk"
+        values = (
+            self.get_queryset()
+            .select_related(None)
+            .prefetch_related(None)
+            .order_by(id_field)
+            .values_list(id_field, flat=True)
+            .iterator(chunk_size=self.batch_size * 10)
+        )
+        ids = array("q")
+        for value in values:
+            if not isinstance(value, int):
+                string_ids = [str(id_value) for id_value in ids]
+                string_ids.append(str(value))
+                string_ids.extend(str(id_value) for id_value in values)
+                string_ids.sort()
+                return string_ids
+            ids.append(value)
+        return ids
+
+    def get_index_ids(self):
+        """
+        Returns sorted integer collection ids as an ``array("q")`` and a list of
+        the ids that aren't integers.
+        """
+        ids = array("q")
+        string_ids = []
+        for document in self.export_index_documents():
+            try:
+                ids.append(int(document["id"]))
+            except ValueError:
+                string_ids.append(document["id"])
+        return sort_ids(ids), string_ids
+
+    def get_index_hashes(self):
+        """
+        Returns sorted integer collection ids and the first 64 bits of their content
+        hashes as two aligned ``array("q")``, and a dict of hash keys for the ids
+        that aren't integers.
+        """
+        ids = array("q")
+        hash_keys = array("q")
+        string_hash_keys = {}
+        for document in self.export_index_documents(f"id,{self.content_hash_field}"):
+            hash_key = get_hash_key(document.get(self.content_hash_field))
+            try:
+                ids.append(int(document["id"]))
+                hash_keys.append(hash_key)
+            except ValueError:
+                string_hash_keys[document["id"]] = hash_key
+        ids, hash_keys = sort_id_pairs(ids, hash_keys)
+        return ids, hash_keys, string_hash_keys
+
+    def get_stale_ids(self):
+        """Returns ids of documents whose stored content hash differs from the database."""
+        ids, hash_keys, string_hash_keys = self.get_index_hashes()
+        id_field = self.Meta.id_field or "pk"
+        stale_ids = []
+        for chunk in self.iterate_chunks(self.get_queryset()):
+            for instance in chunk:
+                id_value = getattr(instance, id_field)
+                if isinstance(id_value, int):
+                    position = bisect.bisect_left(ids, id_value)
+                    if position == len(ids) or ids[position] != id_value:
+                        continue
+                    hash_key = hash_keys[position]
+                elif str(id_value) in string_hash_keys:
+                    hash_key = string_hash_keys[str(id_value)]
+                else:
+                    continue
+                try:
+                    content_hash = self.get_content_hash(instance)
+                except Exception:
+                    continue
+                if hash_key != get_hash_key(content_hash):
+                    stale_ids.append(id_value)
+        return stale_ids
+
+    def import_by_ids(self, ids):
+        id_field = self.Meta.id_field or "pk"
+        counter = 0
+        for start in range(0, len(ids), self.batch_size):
+            chunk_ids = list(ids[start : start + self.batch_size])
+            counter += self.update_documents(self.get_queryset().filter(**{f"{id_field}__in": chunk_ids}))
+        return counter
+
+    def delete_by_ids(self, ids):
+        for start in range(0, len(ids), self.batch_size):
+            chunk_ids = ",".join(f"`{id_value}`" for id_value in ids[start : start + self.batch_size])
+            for collection_name in self.get_collection_names():
+                self.typesense_client.collections[collection_name].documents.delete({"filter_by": f"id:[{chunk_ids}]"})
+        return len(ids)
+
+    def reconcile(self, check_hashes=False, dry_run=False):
+        """
+        Brings the collection in line with the database without rebuilding it.
+
+        Rows missing from the collection are imported, documents without a row
+        are deleted and, with ``check_hashes``, documents whose content hash is
+        outdated are imported again.
+
+        The collection is read before the database: a row indexed in between is
+        then reported missing and upserted again, instead of being taken for an
+        orphan and deleted.
+        """
+        index_ids, unmatched_ids = self.get_index_ids()
+        database_ids = self.get_database_ids()
+        if not isinstance(database_ids, array):
+            index_ids = sorted([str(id_value) for id_value in index_ids] + unmatched_ids)
+            unmatched_ids = []
+        missing_ids = list(sorted_difference(database_ids, index_ids))
+        orphan_ids = list(sorted_difference(index_ids, database_ids)) + unmatched_ids
+        del database_ids, index_ids
+        stale_ids = []
+        if check_hashes and self.content_hash_field:
+            stale_ids = self.get_stale_ids()
+        if not dry_run:
+            self.delete_by_ids(orphan_ids)
+            self.import_by_ids(missing_ids + stale_ids)
+        return {"missing": len(missing_ids), "orphaned": len(orphan_ids), "stale": len(stale_ids)}
 
     def delete_document(self, index_document_id):
+        if self.shard_count and not self.shard_field:
+            collection_names = [self.get_shard_collection_name(self.get_shard(index_document_id))]
+        else:
+            collection_names = self.get_collection_names()
+        for collection_name in collection_names:
             try:
-                self.typesense_client.collections[self.collection_name].documents[str(index_document_id)].delete()
+                self.typesense_client.collections[collection_name].documents[str(index_document_id)].delete()
             except Exception:
                 pass
 
+    def check_multi_search_results(self, searches, results):
+        """Raises the error of the first failed search of a multi search response."""
+        if len(results) != len(searches):
+            raise typesense.exceptions.TypesenseClientError("Multi search returned an unexpected number of results")
+        for result in results:
+            if "error" in result:
+                raise typesense.exceptions.TypesenseClientError(f"[Errno {result.get('code')}] {result['error']}")
+
+    def perform_multi_search(self, search_parameters, filter_by=None, shard_key=None, sort_by=None):
+        """
+        Runs a search through multi_search and returns ``(found, hits)``.
+
+        On a sharded document every shard that may hold results is asked for its
+        first ``page * per_page`` hits, in pages of at most ``MAX_PER_PAGE``, and
+        the hits are merged by ``sort_by`` (by relevance when not set) before the
+        requested page is cut out. Sorting by expressions that aren't stored in
+        the hits (geo distance, ``_eval``, text match buckets) raises ``ValueError``.
+        """
+        collection_names = self.get_search_collection_names(filter_by, shard_key)
+        if len(collection_names) == 1:
+            searches = [dict(search_parameters, collection=collection_names[0])]
+            search_response = self.typesense_client.multi_search.perform({"searches": searches})
+            results = search_response.get("results") or []
+            self.check_multi_search_results(searches, results)
+            return results[0].get("found"), decode_multi_search_hits(search_response)
+        if sort_by:
+            parse_sort_by(sort_by, [])
+        page = search_parameters.get("page", 1)
+        per_page = search_parameters.get("per_page", 10)
+        needed = page * per_page
+        shard_per_page = min(needed, MAX_PER_PAGE)
+        shard_results = {collection_name: {"found": 0, "hits": []} for collection_name in collection_names}
+        pending_collection_names = collection_names
+        shard_page = 1
+        while pending_collection_names:
+            searches = [
+                dict(search_parameters, collection=collection_name, page=shard_page, per_page=shard_per_page)
+                for collection_name in pending_collection_names
+            ]
+            search_response = self.typesense_client.multi_search.perform({"searches": searches})
+            results = search_response.get("results") or []
+            self.check_multi_search_results(searches, results)
+            next_collection_names = []
+            for collection_name, result in zip(pending_collection_names, results):
+                hits = result.get("hits") or []
+                shard_result = shard_results[collection_name]
+                shard_result["found"] = result.get("found") or 0
+                shard_result["hits"].extend(hits)
+                fetched = len(shard_result["hits"])
+                if len(hits) == shard_per_page and fetched < needed and fetched < shard_result["found"]:
+                    next_collection_names.append(collection_name)
+            pending_collection_names = next_collection_names
+            shard_page += 1
+        found = sum(shard_result["found"] for shard_result in shard_results.values())
+        return found, merge_hits(list(shard_results.values()), sort_by, (page - 1) * per_page, per_page)
+
+    def get_vector_fields(self):
+        return [
+            name
+            for name, field_type in self.fields.items()
+            if isinstance(field_type, (EmbeddingField, SentenceTransformerEmbeddingField, ImageField))
+        ]
+
+    def get_exclude_fields(self, exclude_fields=None, include_vectors=False):
+        """
+        Returns the ``exclude_fields`` parameter: ``exclude_fields`` plus all
+        embedding and image fields unless ``include_vectors`` is set.
+        """
+        if isinstance(exclude_fields, str):
+            exclude_fields = [name.strip() for name in exclude_fields.split(",") if name.strip()]
+        exclude_fields = list(exclude_fields or [])
+        if not include_vectors:
+            exclude_fields.extend(name for name in self.get_vector_fields() if name not in exclude_fields)
+        return ",".join(exclude_fields)
+
     def search(
         self,
         q,
@@ -197,7 +857,10 @@ class TypesenseDocument:
         enable_typos_for_numerical_tokens=True,
         enable_typos_for_alpha_numerical_tokens=True,
         synonym_num_typos=0,
-        exclude_fields=None
+        exclude_fields=None,
+        include_vectors=False,
+        shard_key=None,
+        as_dict=False,
     ):
         search_parameters = {
             "q": q,
@@ -232,46 +895,31 @@ class TypesenseDocument:
             search_parameters["enable_typos_for_alpha_numerical_tokens"] = enable_typos_for_alpha_numerical_tokens
         if synonym_num_typos:
             search_parameters["synonym_num_typos"] = synonym_num_typos
-        if exclude_fields:
+        if exclude_fields := self.get_exclude_fields(exclude_fields, include_vectors):
             search_parameters["exclude_fields"] = exclude_fields
 
-        search_response = self.typesense_client.collections[self.collection_name].documents.search(search_parameters)
+        collection_names = self.get_search_collection_names(filter_by, shard_key)
+        if len(collection_names) > 1:
+            found, hits = self.perform_multi_search(search_parameters, filter_by, shard_key, sort_by)
+            return {"count": found, "num_page": page, "search_results": format_hits(hits, as_dict, include_score)}
+        search_response = self.typesense_client.collections[collection_names[0]].documents.search(search_parameters)
         return_data = {"count": search_response.get("found"), "num_page": page}
-        results = []
-        hits = search_response.get("hits")
-        for hit in hits:
-            document = hit.get("document")
-            if include_score:
-                if score := hit.get("text_match"):
-                    document["score"] = score
-                if vector_distance := hit.get("vector_distance"):
-                    document["vector_distance"] = vector_distance
-            results.append(document)
-        return_data["search_results"] = results
+        return_data["search_results"] = format_hits(decode_hits(search_response), as_dict, include_score)
         return return_data
     
-    def semantic_search(self,query,query_by,embedding_field_name,page=1,perpage=50,include_score=False):
+    def semantic_search(self,query,query_by,embedding_field_name,page=1,perpage=50,include_score=False,include_vectors=False,shard_key=None,as_dict=False):
         search_parameters = {
-            "collection": self.collection_name,
             "q": query,
             "query_by":f"{query_by},{embedding_field_name}",
-            "exclude_fields": embedding_field_name,
             "page": page,
             "per_page": perpage
         }
-        search_response = self.typesense_client.multi_search.perform({"searches": [search_parameters]})
-        results = []
-        result = search_response.get("results")
-        if result:
-            hits = result[0].get("hits")
-            for hit in hits:
-                document = hit.get("document")
-                if include_score:
-                    document["vector_distance"] = hit.get("vector_distance")
-                results.append(document)
-        return results
+        if exclude_fields := self.get_exclude_fields(None, include_vectors):
+            search_parameters["exclude_fields"] = exclude_fields
+        found, results = self.perform_multi_search(search_parameters, shard_key=shard_key)
+        return format_hits(results, as_dict, include_score)
 
-    def search_by_image(self, vector_query, embedding_field_name, include_score=False):
+    def search_by_image(self, vector_query, embedding_field_name, include_score=False, include_vectors=False, shard_key=None, as_dict=False):
         embedding_exist = False
         embedding_field = self.fields.get(embedding_field_name)
         image_field_name = None
@@ -282,46 +930,31 @@ class TypesenseDocument:
                 embedding_exist = True
         if embedding_exist:
             search_parameters = {
-                "collection": self.collection_name,
                 "q": "*",
                 "vector_query": f"{embedding_field_name}:([], {image_field_name}:{vector_query})",
             }
-            search_response = self.typesense_client.multi_search.perform({"searches": [search_parameters]})
-            results = []
-            result = search_response.get("results")
-            if result:
-                hits = result[0].get("hits")
-                for hit in hits:
-                    document = hit.get("document")
-                    if include_score:
-                        document["vector_distance"] = hit.get("vector_distance")
-                    results.append(document)
-            return results
+            if exclude_fields := self.get_exclude_fields(None, include_vectors):
+                search_parameters["exclude_fields"] = exclude_fields
+            found, results = self.perform_multi_search(search_parameters, shard_key=shard_key)
+            return format_hits(results, as_dict, include_score)
         else:
             return []
         
-    def vector_search(self,query,sentence_transformer_field,page=1,perpage=50,include_score=False,k=100):
+    def vector_search(self,query,sentence_transformer_field,page=1,perpage=50,include_score=False,k=100,include_vectors=False,shard_key=None,as_dict=False):
+        results = []
         for field_name,field in self.fields.items():
             if field_name == sentence_transformer_field:
                 embeddings = field.prepare_value(query,self.sentence_transformer_model)
                 search_parameters = {
-                    "collection": self.collection_name,
                     "q": "*",
                     "vector_query":f"{sentence_transformer_field}:({embeddings},k:{k})",
-                    "exclude_fields": sentence_transformer_field,
                     "page": page,
                     "per_page": perpage
                 }
-                search_response = self.typesense_client.multi_search.perform({"searches": [search_parameters]})
-                results = []        
-                result = search_response.get("results")
-                if result:
-                    hits = result[0].get("hits")
-                    for hit in hits:
-                        document = hit.get("document")
-                        if include_score:
-                            document["vector_distance"] = hit.get("vector_distance")
-                        results.append(document)
+                if exclude_fields := self.get_exclude_fields(None, include_vectors):
+                    search_parameters["exclude_fields"] = exclude_fields
+                found, results = self.perform_multi_search(search_parameters, shard_key=shard_key)
+                results = format_hits(results, as_dict, include_score)
                 break
         return results
 
@@ -330,16 +963,19 @@ class TypesenseDocument:
             "root": root,
             "synonyms": synonyms,
         }
-        self.typesense_client.collections[self.collection_name].synonyms.upsert(name, synonym)
+        for collection_name in self.get_collection_names():
+            self.typesense_client.collections[collection_name].synonyms.upsert(name, synonym)
 
     def add_multi_way_synonyms(self, name, synonyms):
-        self.typesense_client.collections[self.collection_name].synonyms.upsert(name, synonyms)
+        for collection_name in self.get_collection_names():
+            self.typesense_client.collections[collection_name].synonyms.upsert(name, synonyms)
 
     def delete_synonyms(self, name):
-        self.typesense_client.collections[self.collection_name].synonyms[name].delete()
+        for collection_name in self.get_collection_names():
+            self.typesense_client.collections[collection_name].synonyms[name].delete()
 
     def get_synonyms(self, name):
-        return self.typesense_client.collections[self.collection_name].synonyms.retrieve()
+        return self.typesense_client.collections[self.get_collection_names()[0]].synonyms.retrieve()
 
     def get_instances_from_related(self, related_instance):
         raise NotImplementedError
@@ -368,22 +1004,24 @@ class TypesenseDocument:
                     if callable(attr):
                         attr = attr()
                     document[name] = field_type.prepare_value(attr)
-                for embedding in embeddings:
-                    embed_field = embedding.from_field
-                    embed_value = document.get(embed_field)
-                    if embed_value is None:
-                        raise TypeError
-                for sentence_transformer_field in sentence_transformers_fields:
-                    embed_field = sentence_transformer_field.from_field
-                    embed_value = document.get(embed_field)
-                    if embed_value is None:
-                        raise TypeError
+            for embedding in embeddings:
+                embed_field = embedding.from_field
+                embed_value = document.get(embed_field)
+                if embed_value is None:
+                    raise TypeError
+            for sentence_transformer_field in sentence_transformers_fields:
+                embed_field = sentence_transformer_field.from_field
+                embed_value = document.get(embed_field)
+                if embed_value is None:
+                    raise TypeError
+                else:
+                    if embed_values_lists.get(sentence_transformer_field.field_name):
+                        embed_values_lists[sentence_transformer_field.field_name].append(embed_value)
                     else:
-                        if embed_values_lists.get(sentence_transformer_field.field_name):
-                            embed_values_lists[sentence_transformer_field.field_name].append(embed_value)
-                        else:
-                            embed_values_lists[sentence_transformer_field.field_name] = [embed_value]
+                        embed_values_lists[sentence_transformer_field.field_name] = [embed_value]
 
+            if self.content_hash_field:
+                document[self.content_hash_field] = self.get_content_hash(instance, document)
             id_field = self.Meta.id_field or "pk"
             id_attr = getattr(instance, id_field)
             document["id"] = str(id_attr)
@@ -392,7 +1030,7 @@ class TypesenseDocument:
            if isinstance(field_type,SentenceTransformerEmbeddingField):
                for_embed = embed_values_lists.get(name)
                if for_embed:
-                    embeddings =sentence_transformer_field.prepare_value(for_embed, self.sentence_transformer_model)
+                    embeddings =field_type.prepare_value(for_embed, self.sentence_transformer_model)
                     for (document,embedding) in zip(documents_list,embeddings):
                         document[name] = embedding
         return documents_list
\ No newline at end of file
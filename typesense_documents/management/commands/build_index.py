@@ -1,4 +1,6 @@
-from django.core.management.base import BaseCommand
+import os
+
+from django.core.management.base import BaseCommand, CommandError
 from typesense_documents.registry import typesense_registry
 
 
@@ -7,10 +9,27 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--use-batch", action="store_true",help="Use batches for update")
+        parser.add_argument("--to-file", metavar="DIRECTORY", help="Write prepared documents to an empty directory instead of typesense")
+        parser.add_argument("--from-file", metavar="DIRECTORY", help="Create collections from files written with --to-file")
+        parser.add_argument("--workers", type=int, default=4, help="Parallel uploads for --from-file")
 
     def handle(self, *args, **options):
+        if options["to_file"] and options["from_file"]:
+            raise CommandError("--to-file and --from-file can't be used together")
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
+        if options["to_file"] and os.path.isdir(options["to_file"]) and os.listdir(options["to_file"]):
+            raise CommandError(f"{options['to_file']} is not empty, files of an older dump would be loaded too")
         use_batch = False
-        if options["use-batch"]:
+        if options["use_batch"]:
             use_batch = True
         for document in typesense_registry.index:
-            document().init_collection(use_batch=use_batch)
+            if options["to_file"]:
+                document().dump_collection(options["to_file"])
+            elif options["from_file"]:
+                try:
+                    document().load_collection(options["from_file"], workers=options["workers"])
+                except (FileNotFoundError, ValueError) as e:
+                    raise CommandError(e)
+            else:
+                document().init_collection(use_batch=use_batch)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from typesense_documents.registry import typesense_registry
+
+
+class Command(BaseCommand):
+    help = "Import missing documents and delete orphaned ones without rebuilding collections"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check-hashes", action="store_true", help="Reimport documents with outdated content hash")
+        parser.add_argument("--dry-run", action="store_true", help="Only report differences")
+
+    def handle(self, *args, **options):
+        for document in typesense_registry.index:
+            document_instance = document()
+            result = document_instance.reconcile(check_hashes=options["check_hashes"], dry_run=options["dry_run"])
+            print(
+                f"{document_instance.collection_name}: {result['missing']} missing, "
+                f"{result['orphaned']} orphaned, {result['stale']} stale"
+            )
@@ -1,3 +1,11 @@
+import copy
+import datetime
+import uuid
+from decimal import Decimal
+
+IMMUTABLE_TYPES = (str, int, float, bool, bytes, type(None), Decimal, uuid.UUID, datetime.date, datetime.time, datetime.timedelta)
+
+
 class CollectionRegistry:
     def __init__(self):
         self.index = set()
@@ -15,19 +23,71 @@ class CollectionRegistry:
                     self.related_models[related_model].add(document)
         return document
 
-    def update(self, instance):
+    def snapshot(self, instance):
+        """Remembers indexed model values so later saves can be diffed against them."""
+        if instance.__class__ in self.models:
+            snapshot = {}
+            for field in instance._meta.concrete_fields:
+                if field.attname in instance.__dict__:
+                    value = instance.__dict__[field.attname]
+                    # Only values that can be changed in place (JSONField, ArrayField) need a copy.
+                    snapshot[field.attname] = value if isinstance(value, IMMUTABLE_TYPES) else copy.deepcopy(value)
+            instance._typesense_snapshot = snapshot
+
+    def forget_snapshot(self, instance):
+        """
+        Drops the snapshot of an instance that wasn't loaded from the database
+        (``Model(pk=5, ...).save()``, deserialized objects): its values were never
+        compared with the indexed ones, so the whole document has to be sent.
+        """
+        if instance._state.adding:
+            instance.__dict__.pop("_typesense_snapshot", None)
+
+    def get_changed_fields(self, instance, created=False, update_fields=None):
+        """
+        Returns attnames changed since the last snapshot, or None when it's unknown
+        and the whole document has to be sent.
+        """
+        snapshot = getattr(instance, "_typesense_snapshot", None)
+        if created or snapshot is None:
+            return None
+        changed_fields = set()
+        for field in instance._meta.concrete_fields:
+            if field.attname not in instance.__dict__:
+                continue
+            if field.attname not in snapshot or snapshot[field.attname] != instance.__dict__[field.attname]:
+                changed_fields.add(field.attname)
+        if update_fields is not None:
+            saved_fields = set()
+            for field_name in update_fields:
+                saved_fields.add(instance._meta.get_field(field_name).attname)
+            changed_fields &= saved_fields
+        return changed_fields
+
+    def update(self, instance, changed_fields=None, update_related=True, created=False):
         if instance.__class__ in self.models:
             for index_class in self.index:
                 if index_class.Meta.model == instance.__class__:
-                    index_class().update_document(instance)
-
-        if instance.__class__ in self.related_models:
-            for document in self.related_models[instance.__class__]:
-                if document in self.index:
-                    document_instance = document()
-                    related_for_update = document_instance.get_instances_from_related(instance)
-                    for related_instance in related_for_update:
-                        document_instance.update_document(related_instance)
+                    index_class().update_document(instance, changed_fields=changed_fields, created=created)
+            self.snapshot(instance)
+
+        # A save that changed no column can't have changed documents built from it.
+        if update_related and changed_fields != set():
+            for document in self.get_related_documents(instance.__class__):
+                document().update_related_documents(instance)
+
+    def get_related_documents(self, model):
+        return [document for document in self.related_models.get(model, ()) if document in self.index]
+
+    def get_document(self, document_name):
+        for document in self.index:
+            if document.__name__ == document_name:
+                return document
+
+    def get_model(self, model_name):
+        for model in self.models | set(self.related_models):
+            if model.__name__ == model_name:
+                return model
 
     def delete(self,instance_pk, model_name):
         for model in typesense_registry.models:
@@ -0,0 +1,148 @@
+from collections.abc import Mapping
+
+
+class SearchHit(Mapping):
+    """
+    A single search hit.
+
+    Reads like the returned document and keeps the hit metadata in attributes,
+    the document dict from the response is used as is, without copying.
+
+    Attributes:
+        document (dict): The document from the response.
+        text_match (int): The text match score.
+        vector_distance (float): The distance to the query vector.
+        highlights (list): The highlights of the hit.
+    """
+
+    __slots__ = ("document", "text_match", "vector_distance", "highlights")
+
+    def __init__(self, document, text_match=None, vector_distance=None, highlights=None):
+        self.document = document
+        self.text_match = text_match
+        self.vector_distance = vector_distance
+        self.highlights = highlights
+
+    def __getitem__(self, key):
+        if key in self.document:
+            return self.document[key]
+        if key == "score" and self.text_match is not None:
+            return self.text_match
+        if key == "vector_distance" and self.vector_distance is not None:
+            return self.vector_distance
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.document)
+
+    def __len__(self):
+        return len(self.document)
+
+    def __repr__(self):
+        return f"SearchHit({self.document!r})"
+
+    def to_dict(self, include_score=False):
+        """
+        Returns a copy of the document, with ``score`` and ``vector_distance``
+        keys when ``include_score`` is set.
+        """
+        document = dict(self.document)
+        if include_score:
+            if self.text_match is not None:
+                document["score"] = self.text_match
+            if self.vector_distance is not None:
+                document["vector_distance"] = self.vector_distance
+        return document
+
+
+def decode_hits(response):
+    """Returns SearchHit objects for the hits of a search response."""
+    return [
+        SearchHit(hit.get("document"), hit.get("text_match"), hit.get("vector_distance"), hit.get("highlights"))
+        for hit in response.get("hits") or []
+    ]
+
+
+def format_hits(hits, as_dict=False, include_score=False):
+    """
+    Returns ``hits`` as they are, or as JSON serializable dicts when ``as_dict``
+    is set, with ``score`` and ``vector_distance`` keys when ``include_score`` is set.
+    """
+    if not as_dict:
+        return hits
+    return [hit.to_dict(include_score) for hit in hits]
+
+
+def decode_multi_search_hits(response):
+    """Returns SearchHit objects for the first search of a multi search response."""
+    results = response.get("results")
+    if not results:
+        return []
+    return decode_hits(results[0])
+
+
+MERGEABLE_SPECIAL_FIELDS = ("_text_match", "_vector_distance")
+
+
+def get_sort_value(hit, field_name):
+    if field_name == "_text_match":
+        return hit.get("text_match")
+    if field_name == "_vector_distance":
+        return hit.get("vector_distance")
+    if field_name == "_rank_fusion_score":
+        return (hit.get("hybrid_search_info") or {}).get("rank_fusion_score")
+    return (hit.get("document") or {}).get(field_name)
+
+
+def parse_sort_by(sort_by, hits):
+    """
+    Returns ``(field_name, descending)`` pairs for ``sort_by``, or the relevance
+    order Typesense uses for the kind of search the hits come from.
+    """
+    if not sort_by:
+        if any("hybrid_search_info" in hit for hit in hits):
+            return [("_rank_fusion_score", True)]
+        if any("vector_distance" in hit for hit in hits):
+            return [("_vector_distance", False)]
+        return [("_text_match", True)]
+    sort_fields = []
+    for sort_field in split_sort_by(sort_by):
+        field_name, separator, order = sort_field.rpartition(":")
+        if not separator:
+            field_name, order = order, ""
+        field_name = field_name.strip()
+        if "(" in field_name or (field_name.startswith("_") and field_name not in MERGEABLE_SPECIAL_FIELDS):
+            # Geo distances, _eval(), text match buckets etc. aren't in the hits, so
+            # hits of different searches can't be ordered by them.
+            raise ValueError(f"Hits of several searches can't be merged by {sort_field.strip()!r}")
+        sort_fields.append((field_name, order.strip().lower() != "asc"))
+    return sort_fields
+
+
+def split_sort_by(sort_by):
+    """Splits ``sort_by`` on the commas that aren't inside parentheses."""
+    sort_fields = []
+    depth = 0
+    start = 0
+    for position, char in enumerate(sort_by):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            sort_fields.append(sort_by[start:position])
+            start = position + 1
+    sort_fields.append(sort_by[start:])
+    return sort_fields
+
+
+def merge_hits(responses, sort_by=None, offset=0, limit=None):
+    """Merges hits of several search responses and returns SearchHit objects of one page."""
+    hits = [hit for response in responses for hit in response.get("hits") or []]
+    for field_name, descending in reversed(parse_sort_by(sort_by, hits)):
+        if descending:
+            hits.sort(key=lambda hit: (get_sort_value(hit, field_name) is not None, get_sort_value(hit, field_name)), reverse=True)
+        else:
+            hits.sort(key=lambda hit: (get_sort_value(hit, field_name) is None, get_sort_value(hit, field_name)))
+    end = None if limit is None else offset + limit
+    return decode_hits({"hits": hits[offset:end]})
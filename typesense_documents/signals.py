@@ -8,9 +8,19 @@ class SignalProcessor:
         models.signals.post_save.connect(self.handle_save)
         models.signals.post_delete.connect(self.handle_delete)
         models.signals.m2m_changed.connect(self.handle_m2m_changed)
+        for model in typesense_registry.models:
+            models.signals.post_init.connect(self.handle_init, sender=model)
+            models.signals.pre_save.connect(self.handle_pre_save, sender=model)
+
+    def handle_init(self, sender, instance, **kwargs):
+        typesense_registry.snapshot(instance)
+
+    def handle_pre_save(self, sender, instance, **kwargs):
+        typesense_registry.forget_snapshot(instance)
 
-    def handle_save(self, sender, instance, **kwargs):
-        typesense_registry.update(instance)
+    def handle_save(self, sender, instance, created=False, update_fields=None, **kwargs):
+        changed_fields = typesense_registry.get_changed_fields(instance, created, update_fields)
+        typesense_registry.update(instance, changed_fields=changed_fields, created=created)
 
     def handle_delete(self, sender, instance, **kwargs):
         instance_pk = typesense_registry.get_model_pk(instance)
@@ -18,14 +28,18 @@ class SignalProcessor:
 
     def handle_m2m_changed(self, sender, instance, action, **kwargs):
         if action in ("post_add", "post_remove", "post_clear"):
-            self.handle_save(sender, instance)
+            typesense_registry.update(instance)
 
 
 
 class CelerySignalProcessor(SignalProcessor):
-    def handle_save(self, sender, instance, **kwargs):
+    def handle_save(self, sender, instance, created=False, update_fields=None, **kwargs):
         instance_pk = typesense_registry.get_model_pk(instance) or instance.pk
-        self.save_task.apply_async((instance_pk,instance.__class__.__name__),countdown=5)
+        changed_fields = typesense_registry.get_changed_fields(instance, created, update_fields)
+        if changed_fields is not None:
+            changed_fields = sorted(changed_fields)
+        typesense_registry.snapshot(instance)
+        self.save_task.apply_async((instance_pk,instance.__class__.__name__,changed_fields,created),countdown=5)
 
     def handle_delete(self, sender, instance, **kwargs):
         instance_pk = typesense_registry.get_model_pk(instance)
@@ -33,23 +47,31 @@ class CelerySignalProcessor(SignalProcessor):
 
     def handle_m2m_changed(self, sender, instance, action, **kwargs):
         if action in ("post_add", "post_remove", "post_clear"):
-            self.handle_save(sender, instance)
+            instance_pk = typesense_registry.get_model_pk(instance) or instance.pk
+            self.save_task.apply_async((instance_pk,instance.__class__.__name__,None),countdown=5)
 
     @shared_task()
-    def save_task(pk,model_name):
-        instance = None
-        for model in typesense_registry.models:
-            if model.__name__ == model_name:
-                instance = model.objects.get(pk=pk)
-                typesense_registry.update(instance)
-        for model in typesense_registry.related_models:
-            if model.__name__ == model_name:
-                for document in typesense_registry.related_models[model]:
-                    document_instance = document()
-                    instance = model.objects.get(pk=pk)
-                    related_for_update = document_instance.get_instances_from_related(instance)
-                    for related_instance in related_for_update:
-                        document_instance.update_document(related_instance)
+    def save_task(pk,model_name,changed_fields=None,created=False):
+        if changed_fields is not None:
+            changed_fields = set(changed_fields)
+        model = typesense_registry.get_model(model_name)
+        if model is None:
+            return
+        instance = model.objects.get(pk=pk)
+        typesense_registry.update(instance, changed_fields=changed_fields, update_related=False, created=created)
+        if changed_fields == set():
+            return
+        for document in typesense_registry.get_related_documents(model):
+            CelerySignalProcessor.update_related_task.delay(document.__name__,pk,model_name)
+
+    @shared_task()
+    def update_related_task(document_name,pk,model_name):
+        document = typesense_registry.get_document(document_name)
+        model = typesense_registry.get_model(model_name)
+        if document is None or model is None:
+            return
+        instance = model.objects.get(pk=pk)
+        document().update_related_documents(instance)
 
     @shared_task()
     def delete_task(pk,model_name):